@@ -3,18 +3,35 @@ import xarray as xr
 import numpy as np
 
 
+def _percentile_block(arr, q):
+    # contiguous copy so the single in-place sort along time is
+    # cache-friendly and the input block is left untouched
+    arr = arr.copy()
+    return np.percentile(arr, q, axis=0,
+                         method='lower',
+                         overwrite_input=True)
+
+
 def percentile(ts, q=[10, 25, 50, 75, 90], name_prefix='s2'):
 
+    # all percentiles of a pixel come from one sort over the full series
+    ts = ts.chunk({'time': -1})
+
     chunks = list(ts.chunks)
 
-    chunks[0] = (len(q),) * len(chunks[1])
+    chunks[0] = (len(q),) * len(chunks[0])
 
     p = da.map_blocks(
-        np.percentile,
+        _percentile_block,
         ts.data,
-        q,
+        np.asarray(q),
         chunks=chunks,
-        axis=0).astype(np.float32)
+        dtype=ts.dtype).astype(np.float32)
+
+    # apply reflectance scaling (if any) on the reduced array
+    scale = ts.attrs.get('scale_factor', 1)
+    if scale != 1:
+        p = p * np.float32(scale)
 
     p = da.concatenate([p[:, b, :, :] for b in range(ts.band.size)],
                        axis=0)
@@ -37,6 +37,7 @@ import sys
 import numpy as np
 import dask.array as da
 import xarray as xr
+from numba import njit, prange
 
 
 RSI_META_S2 = {
@@ -357,12 +358,44 @@ def rvi(VH, VV):
     return (4 * VH) / (VV + VH)
 
 
-def _rsi_chunk(ts, bands, indices, clip=True):
+@njit(parallel=True, cache=True)
+def _norm_diff_batch(ts, ids_a, ids_b, slots, vmin, vmax, clip, out):
+    """Compute a batch of normalized difference indices in one pass over
+    the chunk: each (t, y, x) position is read once for all indices.
+    Normalized differences are scale-invariant, so no reflectance
+    scaling is needed."""
+    nt, _, ny, nx = ts.shape
+    n = ids_a.size
+    for y in prange(ny):
+        for t in range(nt):
+            for x in range(nx):
+                for i in range(n):
+                    a = np.float32(ts[t, ids_a[i], y, x])
+                    b = np.float32(ts[t, ids_b[i], y, x])
+                    v = (a - b) / (a + b)
+                    if clip:
+                        if v < vmin[i]:
+                            v = vmin[i]
+                        elif v > vmax[i]:
+                            v = vmax[i]
+                    else:
+                        if (v < vmin[i]) or (v > vmax[i]):
+                            v = np.float32(np.nan)
+                    out[t, slots[i], y, x] = v
+
+
+def _rsi_chunk(ts, bands, indices, clip=True, scale=1):
     st, sb, sy, sx = ts.shape
 
     nout = len(indices)
     out = np.zeros((st, nout, sy, sx), dtype=np.float32)
 
+    scale = np.float32(scale)
+
+    # the normalized difference indices share one formula: batch them
+    # in a single compiled kernel, the rest goes through numpy funcs
+    nd_a, nd_b, nd_slots, nd_min, nd_max = [], [], [], [], []
+
     for i, rsi in enumerate(indices):
         rsi_meta = RSI_META_S2[rsi]
         rsi_bands = rsi_meta['bands']
@@ -371,7 +404,16 @@ def _rsi_chunk(ts, bands, indices, clip=True):
 
         bands_ids = [bands.index(b) for b in rsi_bands]
 
-        arr = rsi_func(*[ts[:, b, :, :] for b in bands_ids])
+        if rsi_func is norm_diff:
+            nd_a.append(bands_ids[0])
+            nd_b.append(bands_ids[1])
+            nd_slots.append(i)
+            nd_min.append(rsi_range_min)
+            nd_max.append(rsi_range_max)
+            continue
+
+        arr = rsi_func(*[ts[:, b, :, :].astype(np.float32) * scale
+                         for b in bands_ids])
 
         if clip:
             vmin = rsi_range_min
@@ -384,6 +426,16 @@ def _rsi_chunk(ts, bands, indices, clip=True):
 
         out[:, i, :, :] = arr
 
+    if nd_slots:
+        _norm_diff_batch(ts,
+                         np.array(nd_a),
+                         np.array(nd_b),
+                         np.array(nd_slots),
+                         np.array(nd_min, dtype=np.float32),
+                         np.array(nd_max, dtype=np.float32),
+                         clip,
+                         out)
+
     return out
 
 
@@ -403,14 +455,19 @@ def rsi_ts(ts, indices, clip=True):
     nout = len(indices)
     chunks[1] = (nout,) * len(chunks[1])
 
+    # scaled integer data (e.g. uint16 reflectance in 0.0001 units) is
+    # brought to physical values inside the chunk function
+    scale = ts.attrs.get('scale_factor', 1)
+
     new_ts = da.map_blocks(
         _rsi_chunk,
         ts.data,
         ts.band.values.tolist(),
         indices,
-        dtype=ts.dtype,
+        dtype=np.float32,
         chunks=chunks,
-        clip=clip
+        clip=clip,
+        scale=scale
     )
 
     new_darr = xr.DataArray(new_ts,
@@ -1,4 +1,3 @@
-import warnings
 from datetime import datetime, timedelta
 from dateutil.parser import parse as parse_date
 
@@ -6,6 +5,7 @@ import pandas as pd
 import numpy as np
 import dask.array as da
 import xarray as xr
+from numba import njit, prange
 
 
 def _get_date_range(start, end, freq, window):
@@ -65,16 +65,7 @@ def calculate_moving_composite(darr: xr.DataArray,
                          '`freq` value.')
 
     before, after = _get_before_after(window)
-    date_range = _get_date_range(start, end, freq, before)
-
-    comp_shape = (darr.shape[0], len(date_range),
-                  darr.shape[2], darr.shape[3])
 
-    comp = da.zeros(comp_shape,
-                    chunks=(1, 1, comp_shape[2], comp_shape[3]),
-                    dtype=darr.dtype)
-    # comp = da.zeros(comp_shape,
-    #                 dtype=darr.dtype)
     time = darr.time.values
 
     start = str(time[0])[:10] if start is None else start
@@ -82,29 +73,32 @@ def calculate_moving_composite(darr: xr.DataArray,
 
     date_range = _get_date_range(start, end, freq, before)
 
-    comp_shape = (len(date_range), darr.shape[1],
-                  darr.shape[2], darr.shape[3])
-
-    comp = da.zeros(comp_shape,
-                    chunks=(1, 1, darr.shape[2], darr.shape[3]),
-                    dtype=darr.dtype)
-
-    time = darr.time.values
     intervals_flags = _get_invervals_flags(date_range,
                                            time,
                                            before,
                                            after,
                                            use_all_obs)
 
-    for i, d in enumerate(date_range):
-        flag = intervals_flags[i]
-        if not any(flag):
-            continue
+    # time is sorted, so each window is a contiguous [start, end) range
+    # of time indices. Empty windows get start == end == 0 and come out
+    # as zeros (nodata).
+    starts = np.zeros(len(date_range), dtype=np.int64)
+    ends = np.zeros(len(date_range), dtype=np.int64)
+    for i, flag in enumerate(intervals_flags):
         idxs = np.where(flag)[0]
+        if idxs.size:
+            starts[i] = idxs[0]
+            ends[i] = idxs[-1] + 1
+
+    data = darr.data.rechunk({0: -1, 1: -1})
 
-        for band_idx in range(comp.shape[1]):
-            comp[i, band_idx, ...] = nonzeromedian(darr.isel(time=idxs,
-                                                             band=band_idx))
+    comp = da.map_blocks(
+        _composite_block,
+        data,
+        dtype=darr.dtype,
+        chunks=((len(date_range),), (darr.shape[1],)) + data.chunks[2:],
+        starts=starts,
+        ends=ends)
 
     darr_out = xr.DataArray(comp,
                             dims=darr.dims,
@@ -151,20 +145,39 @@ def _get_invervals_flags(date_range,
     return intervals_flags
 
 
-def nonzeromedian(arr):
-    """arr should be an xarray with dims (time, y, x)"""
-
-    start_dtype = arr.dtype
-    if start_dtype not in (np.float32, np.float64):
-        arr = arr.astype(np.float32)
-        arr = arr.where(arr != 0, np.nan)
+@njit(parallel=True, fastmath=True, cache=True)
+def _moving_median(arr, starts, ends, nodata):
+    nt, nb, ny, nx = arr.shape
+    nw = starts.size
+    out = np.zeros((nw, nb, ny, nx), dtype=arr.dtype)
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=RuntimeWarning)
-        res = da.nanmedian(arr.data, axis=0)
-
-    # res comes out as float. nans will be casted to 0s when returning to int
-    return res.astype(start_dtype)
+    for w in prange(nw):
+        s = starts[w]
+        e = ends[w]
+        if e <= s:
+            continue
+        vals = np.empty(e - s, dtype=np.float32)
+        for b in range(nb):
+            for y in range(ny):
+                for x in range(nx):
+                    n = 0
+                    for t in range(s, e):
+                        v = arr[t, b, y, x]
+                        if v != nodata:
+                            vals[n] = v
+                            n += 1
+                    if n > 0:
+                        # integer rounding, keeps native dtype
+                        out[w, b, y, x] = int(np.median(vals[:n]) + 0.5)
+
+    return out
+
+
+def _composite_block(arr, starts, ends, nodata=0):
+    """Median of the valid (!= nodata) obs of each composite window, for
+    each (band, y, x) pixel. Thin wrapper around the compiled kernel for
+    `da.map_blocks`."""
+    return _moving_median(arr, starts, ends, nodata)
 
 
 def _get_before_after(window: int):
@@ -1,5 +1,5 @@
-import numba
 import numpy as np
+from numba import njit, prange
 
 # def cubic_spline_interpolation(x, y, xx):
 #     # Compute the second derivatives of the cubic spline
@@ -53,46 +53,48 @@ import numpy as np
 #     return yy
 
 
-@numba.jit(nopython=True, error_model='numpy', fastmath=True)
-def interpolate_ts_linear(arr):
-    out = np.zeros_like(arr)
-    for band in range(arr.shape[1]):
-        for py in range(arr.shape[2]):
+@njit(parallel=True, fastmath=True, cache=True)
+def _interp_block(arr, nodata):
+    out = arr.copy()
+    nt = arr.shape[0]
+    for band in prange(arr.shape[1]):
+        for py in prange(arr.shape[2]):
             for px in range(arr.shape[3]):
 
-                t = arr[:, band, py, px].copy()
+                # forward sweep: linearly fill gaps between valid obs,
+                # tracking the index of the last valid one
+                first = -1
+                last = -1
+                for t in range(nt):
+                    if arr[t, band, py, px] != nodata:
+                        if last >= 0 and t - last > 1:
+                            v0 = float(arr[last, band, py, px])
+                            slope = ((float(arr[t, band, py, px]) - v0)
+                                     / (t - last))
+                            for k in range(last + 1, t):
+                                # integer rounding, keeps native dtype
+                                out[k, band, py, px] = int(
+                                    v0 + slope * (k - last) + 0.5)
+                        if first < 0:
+                            first = t
+                        last = t
 
-                nans_ids = (t == 0)
-                x_valid = np.where(~nans_ids)[0]
-                y_valid = t[x_valid]
-                x_invalid = np.where(nans_ids)[0]
+                if first < 0:
+                    # pixel has no valid obs, nothing to interpolate
+                    continue
 
-                re_init = False
-                if t[0] == 0:
-                    t[0] = np.mean(y_valid)
-                    re_init = True
+                # backward sweep: fill leading/trailing gaps with the
+                # nearest valid observation
+                for t in range(first):
+                    out[t, band, py, px] = arr[first, band, py, px]
+                for t in range(last + 1, nt):
+                    out[t, band, py, px] = arr[last, band, py, px]
 
-                if t[-1] == 0:
-                    t[-1] = np.mean(y_valid)
-                    re_init = True
-
-                if re_init:
-                    nans_ids = (t == 0)
-                    x_valid = np.where(~nans_ids)[0]
-                    y_valid = t[x_valid]
-                    x_invalid = np.where(nans_ids)[0]
-
-                y_new = t
-                m = len(x_invalid)
-                for i in range(m):
-                    j = np.searchsorted(
-                        x_valid, x_invalid[i], side='right') - 1
-                    
-                    q = (x_valid[j + 1] - x_valid[j])
-                    s = (x_invalid[i] - x_valid[j]) / q
-                    
-                    y_new[x_invalid[i]] = (1 - s) * y_valid[j] + s * y_valid[j + 1]
+    return out
 
-                out[:, band, py, px] = y_new
 
-    return out
+def interpolate_ts_linear(arr, nodata=0):
+    """Linear interpolation of nodata gaps along time for each
+    (band, y, x) pixel of a 4d (time, band, y, x) array.
+    Thin wrapper around the compiled kernel for `da.map_blocks`."""
+    return _interp_block(arr, nodata)
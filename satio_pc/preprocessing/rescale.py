@@ -59,6 +59,10 @@ def _rescale_ts(ts,
     return new
 
 
+def _rescale_nearest(ts, scale=2):
+    return np.repeat(np.repeat(ts, scale, axis=-1), scale, axis=-2)
+
+
 def rescale_ts(ds20,
                scale=2,
                order=1,
@@ -71,16 +75,26 @@ def rescale_ts(ds20,
     for i in -1, -2:
         chunks[i] = tuple(map(lambda x: x * scale, chunks[i]))
 
-    darr_scaled = da.map_blocks(
-        _rescale_ts,
-        ds20.data,
-        dtype=ds20.dtype,
-        chunks=chunks,
-        scale=scale,
-        order=order,
-        preserve_range=preserve_range,
-        nodata_value=nodata_value,
-        sigma=sigma)
+    if order == 0 and scale > 1 and scale == int(scale):
+        # nearest-neighbor integer upsampling (e.g. SCL 20m -> 10m) is
+        # a pure pixel repeat, skip the skimage machinery entirely
+        darr_scaled = da.map_blocks(
+            _rescale_nearest,
+            ds20.data,
+            dtype=ds20.dtype,
+            chunks=chunks,
+            scale=int(scale))
+    else:
+        darr_scaled = da.map_blocks(
+            _rescale_ts,
+            ds20.data,
+            dtype=ds20.dtype,
+            chunks=chunks,
+            scale=scale,
+            order=order,
+            preserve_range=preserve_range,
+            nodata_value=nodata_value,
+            sigma=sigma)
 
     xmin, ymin, xmax, ymax = ds20.satio.bounds
     new_res = ds20.attrs.get('resolution',
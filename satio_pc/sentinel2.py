@@ -1,8 +1,13 @@
 import atexit
+import shutil
 import tempfile
+from functools import cached_property
 import numpy as np
 import xarray as xr
+import dask
 import dask.array as da
+import zarr  # noqa
+from numcodecs import Blosc
 from loguru import logger
 
 from satio_pc.preprocessing.composite import calculate_moving_composite
@@ -15,29 +20,37 @@ from satio_pc.features import percentile
 
 def mask_clouds(darr, scl_mask):
     """darr has dims (time, band, y, x),
-    mask has dims (time, y, x)"""
-    mask = da.broadcast_to(scl_mask.data, darr.shape)
-    darr_masked = da.where(~mask, 0, darr)
-    return darr.copy(data=darr_masked)
+    mask has dims (time, y, x) or (time, 1, y, x), True for valid pixels.
+    Multiplying by the 0/1 mask fuses masking into a single pass, with
+    broadcasting on the band axis handled implicitly."""
+    mask = scl_mask.data.astype(darr.dtype)
+    if mask.ndim == 3:
+        mask = mask[:, None, :, :]
+    darr_masked = darr.data * mask
+    return xr.DataArray(darr_masked,
+                        dims=darr.dims,
+                        coords=darr.coords,
+                        attrs=darr.attrs,
+                        name=darr.name)
 
 
 def force_unique_time(darr):
-    """Add microseconds to time vars which repeats in order to make the
-    time index of the DataArray unique, as sometimes observations from the same
-    day can be split in multiple obs"""
-    unique_ts, counts_ts = np.unique(darr.time, return_counts=True)
-    double_ts = unique_ts[np.where(counts_ts > 1)]
-
-    new_time = []
-    c = 0
-    for i in range(darr.time.size):
-        v = darr.time[i].values
-        if v in double_ts:
-            v = v + c
-            c += 1
-        new_time.append(v)
-    new_time = np.array(new_time)
-    darr['time'] = new_time
+    """Add microseconds to time vars which repeat in order to make the
+    time index of the DataArray unique, as sometimes observations from the
+    same day can be split in multiple obs"""
+    times = darr.time.values
+    order = np.argsort(times, kind='stable')
+    sorted_t = times[order]
+
+    # within-group counter: 0 for the first occurrence of each timestamp,
+    # 1 for the second, etc.
+    idx = np.arange(times.size)
+    grp_start = np.r_[True, sorted_t[1:] != sorted_t[:-1]]
+    within = idx - np.maximum.accumulate(np.where(grp_start, idx, 0))
+
+    new_times = np.empty_like(times)
+    new_times[order] = sorted_t + within.astype('timedelta64[us]')
+    darr['time'] = new_times
     return darr
 
 
@@ -59,10 +72,10 @@ def harmonize(data):
         A DataArray with all values harmonized to the old
         processing baseline.
     """
-    baseline = data.coords['s2:processing_baseline'].astype(float)
+    baseline = data.coords['s2:processing_baseline'].values.astype(float)
     baseline_flag = baseline < 4
 
-    if all(baseline_flag):
+    if baseline_flag.all():
         return data
 
     offset = 1000
@@ -70,19 +83,25 @@ def harmonize(data):
              "B05", "B06", "B07", "B08",
              "B8A", "B09", "B10", "B11", "B12"]
 
-    old = data.isel(time=baseline_flag)
-    to_process = list(set(bands) & set(data.band.data.tolist()))
+    band_flag = np.isin(data.band.values, bands)
 
-    new = data.sel(time=~baseline_flag).drop_sel(band=to_process)
+    # (time, band) mask of the obs needing the offset, broadcast on y/x
+    mask = (~baseline_flag[:, None, None, None]
+            & band_flag[None, :, None, None])
 
-    new_harmonized = data.sel(time=~baseline_flag, band=to_process).copy()
+    arr = data.data
+    # int32 intermediate avoids uint16 underflow; values below the
+    # offset clip to 0, matching the old clip(offset) - offset
+    harmonized = da.where(
+        mask,
+        da.maximum(arr.astype(np.int32) - offset, 0),
+        arr).astype(data.dtype)
 
-    new_harmonized = new_harmonized.clip(offset)
-    new_harmonized -= offset
-
-    new = xr.concat([new, new_harmonized], "band").sel(
-        band=data.band.data.tolist())
-    return xr.concat([old, new], dim="time")
+    return xr.DataArray(harmonized,
+                        dims=data.dims,
+                        coords=data.coords,
+                        attrs=data.attrs,
+                        name=data.name)
 
 
 def load_sentinel2_tile(tile,
@@ -114,13 +133,27 @@ def load_sentinel2_tile(tile,
     assets_60m = ['B01', 'B09']
     scl = 'SCL'
 
+    # tune GDAL's vsicurl layer for the S2 COGs: merge adjacent range
+    # requests, keep connections multiplexed and cache reads, so fewer
+    # HTTP round-trips are paid per dask task
+    gdal_env = stackstac.DEFAULT_GDAL_ENV.updated(always=dict(
+        GDAL_HTTP_MERGE_CONSECUTIVE_RANGES='YES',
+        GDAL_HTTP_MULTIPLEX='YES',
+        GDAL_HTTP_VERSION='2',
+        VSI_CACHE='TRUE',
+        VSI_CACHE_SIZE=str(256 * 1024 * 1024),
+        CPL_VSIL_CURL_CHUNK_SIZE=str(1024 * 1024),
+        GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR'))
+
     ds = {}
     assets = {10: assets_10m,
               20: assets_20m,
               60: assets_60m,
               'scl': [scl]}
 
-    chunksize = {10: 1024,
+    # larger 10m chunks amortize the per-request overhead over more
+    # pixels of the same COG
+    chunksize = {10: 2048,
                  20: 512,
                  60: 512,
                  'scl': 512}
@@ -138,7 +171,8 @@ def load_sentinel2_tile(tile,
                                   xy_coords='center',
                                   rescale=False,
                                   dtype=dtype[res],
-                                  fill_value=0)
+                                  fill_value=0,
+                                  gdal_env=gdal_env)
         del ds[res].attrs['spec']
         ds_vars = list(ds[res].coords.keys())
         drop_vars = [v for v in ds_vars if v not in keep_vars]
@@ -156,7 +190,6 @@ def load_sentinel2_tile(tile,
 class ESAWorldCoverTimeSeries:
     def __init__(self, xarray_obj):
         self._obj = xarray_obj
-        self._obj.attrs['bounds'] = self.bounds
         # run check that we have a timeseries
         # assert xarray_obj.dims == ('time', 'band', 'y', 'x')
 
@@ -205,36 +238,71 @@ class ESAWorldCoverTimeSeries:
         """Compute set of percentiles for the time-series bands"""
         return percentile(self._obj, q)
 
-    @property
+    @cached_property
     def bounds(self):
 
-        darr = self._obj
+        # one .values read per axis, everything else is plain python
+        xvals = self._obj.x.values
+        yvals = self._obj.y.values
 
-        res = darr.x[1] - darr.x[0]
-        hres = res / 2
+        hres = float(xvals[1] - xvals[0]) / 2
 
-        xmin = (darr.x[0] - hres).values.tolist()
-        xmax = (darr.x[-1] + hres).values.tolist()
+        xmin = float(xvals[0]) - hres
+        xmax = float(xvals[-1]) + hres
 
-        ymin = (darr.y[-1] - hres).values.tolist()
-        ymax = (darr.y[0] + hres).values.tolist()
+        ymin = float(yvals[-1]) - hres
+        ymax = float(yvals[0]) + hres
 
         return xmin, ymin, xmax, ymax
 
     def harmonize(self):
         return harmonize(self._obj)
 
-    def cache(self, tempdir='.', chunks=(-1, -1, 256, 256)):
-        tmpfile = tempfile.NamedTemporaryFile(suffix='.nc',
-                                              prefix='satio-',
-                                              dir=tempdir)
-
-        chunks = self._obj.chunks if chunks is None else chunks
+    def cache(self, tempdir='.', chunks=None,
+              max_mem_bytes=256 * 1024 * 1024):
+        """Cache the timeseries to a temporary Zarr store and return a
+        dask-backed DataArray reading from it. Chunks are compressed
+        independently (Blosc zstd), so dask workers can write and read
+        them in parallel without the HDF5 global lock.
+
+        By default chunks keep time and band whole and cap the spatial
+        chunks at 256, so all the pipeline stages caching with defaults
+        share the same chunk grid and no rechunk-on-read is needed.
+
+        Blocks whose raw size fits `max_mem_bytes` are cached to an
+        in-memory Zarr store instead of disk, skipping the tmpdir I/O
+        entirely; set `max_mem_bytes=0` to force the disk store."""
+        if chunks is None:
+            sizes = self._obj.sizes
+            chunks = (sizes['time'], sizes['band'],
+                      min(256, sizes['y']), min(256, sizes['x']))
+
+        # resolve -1 / dask chunking to explicit zarr chunk sizes
+        zarr_chunks = tuple(
+            c[0] if isinstance(c, tuple) else (s if c == -1 else min(c, s))
+            for c, s in zip(chunks, self._obj.shape))
+
+        nbytes = self._obj.size * self._obj.dtype.itemsize
+        if nbytes < max_mem_bytes:
+            # the returned DataArray keeps the store alive through its
+            # zarr backend, no extra reference needed
+            store = zarr.MemoryStore()
+        else:
+            store = tempfile.mkdtemp(prefix='satio-', dir=tempdir)
+            atexit.register(shutil.rmtree, store, ignore_errors=True)
+
+        compressor = Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+        encoding = {'data': {'chunks': zarr_chunks,
+                             'compressor': compressor}}
+
+        darr = self._obj.chunk(dict(zip(self._obj.dims, zarr_chunks)))
+        darr.to_dataset(name='data').to_zarr(store,
+                                             mode='w',
+                                             encoding=encoding)
+        # mask_and_scale off: scale_factor & co. are kept as plain attrs,
+        # the cache must round-trip the raw values untouched
+        darr = xr.open_zarr(store, mask_and_scale=False)['data']
 
-        self._obj.to_netcdf(tmpfile.name)
-        darr = xr.open_dataarray(tmpfile.name).chunk(chunks)
-
-        atexit.register(tmpfile.close)
         return darr
 
     def rgb(self, bands=None, vmin=0, vmax=1000, **kwargs):
@@ -300,48 +368,36 @@ def preprocess_s2(ds10_block,
         scl10_block = scl10_block.satio.cache(tmpdirname)
         timer20.load.stop()
 
-        # 10m
-        # mask clouds
-        timer10.composite.start()
-        ds10_block_masked = ds10_block.satio.mask(
-            scl10_block).satio.cache(tmpdirname)
-
-        logger.info("Compositing 10m block data")
-        # composite
-        ds10_block_comp = ds10_block_masked.satio.composite(
-            freq=composite_freq,
-            window=composite_window,
-            start=start_date,
-            end=end_date).satio.cache(tmpdirname)
-        timer10.composite.stop()
-
-        logger.info("Interpolating 10m block data")
-        # interpolation
+        def _clean_ts(ds_block, scl_block, timer, resolution):
+            # mask clouds
+            timer.composite.start()
+            ds_block_masked = ds_block.satio.mask(scl_block)
+
+            logger.info(f"Compositing {resolution}m block data")
+            # composite (lazy, fused with the mask step by dask)
+            ds_block_comp = ds_block_masked.satio.composite(
+                freq=composite_freq,
+                window=composite_window,
+                start=start_date,
+                end=end_date)
+            timer.composite.stop()
+
+            return ds_block_comp.satio.interpolate()
+
+        # the 10m and 20m branches are independent until the merge:
+        # build both graphs lazily and persist them in one go, so the
+        # scheduler interleaves the tasks of the two resolutions
+        lazy10 = _clean_ts(ds10_block, scl10_block, timer10, 10)
+        lazy20 = _clean_ts(ds20_block, scl20_block, timer20, 20)
+
+        logger.info("Interpolating 10m and 20m block data")
         timer10.interpolate.start()
-        ds10_block_interp = ds10_block_comp.satio.interpolate(
-        ).satio.cache(tmpdirname)
-        timer10.interpolate.stop()
-
-        # 20m
-        # mask
-        timer20.composite.start()
-        ds20_block_masked = ds20_block.satio.mask(
-            scl20_block).satio.cache(tmpdirname)
-
-        logger.info("Compositing 20m block data")
-        # composite
-        ds20_block_comp = ds20_block_masked.satio.composite(
-            freq=composite_freq,
-            window=composite_window,
-            start=start_date,
-            end=end_date).satio.cache(tmpdirname)
-        timer20.composite.stop()
-
-        logger.info("Interpolating 20m block data")
-        # interpolation
         timer20.interpolate.start()
-        ds20_block_interp = ds20_block_comp.satio.interpolate(
-        ).satio.cache(tmpdirname)
+        lazy10, lazy20 = dask.persist(lazy10, lazy20)
+
+        ds10_block_interp = lazy10.satio.cache(tmpdirname)
+        ds20_block_interp = lazy20.satio.cache(tmpdirname)
+        timer10.interpolate.stop()
         timer20.interpolate.stop()
 
         logger.info("Merging 10m and 20m series")
@@ -349,20 +405,35 @@ def preprocess_s2(ds10_block,
         ds20_block_interp_10m = ds20_block_interp.satio.rescale(scale=2,
                                                                 order=1,
                                                                 nodata_value=0)
-        dsm10 = xr.concat([ds10_block_interp,
-                           ds20_block_interp_10m],
-                          dim='band')
+        # both arrays share the (time, y, x) grid: stack the dask arrays
+        # directly instead of going through xr.concat's align/reindex
+        band_axis = ds10_block_interp.get_axis_num('band')
+        merged = da.concatenate([ds10_block_interp.data,
+                                 ds20_block_interp_10m.data],
+                                axis=band_axis)
+        bands = np.concatenate([ds10_block_interp.band.values,
+                                ds20_block_interp_10m.band.values])
+        dsm10 = xr.DataArray(merged,
+                             dims=ds10_block_interp.dims,
+                             coords={'time': ds10_block_interp.time,
+                                     'band': bands,
+                                     'y': ds10_block_interp.y,
+                                     'x': ds10_block_interp.x})
+
+        dsm10.attrs = ds10_block.attrs
 
         if reflectance:
-            dsm10 = dsm10.astype(np.float32) / 10000
+            # keep uint16 and let downstream features (indices,
+            # percentiles) apply the scale once inside their kernels
+            dsm10.attrs['scale_factor'] = 0.0001
 
-        dsm10.attrs = ds10_block.attrs
+        # persist before tmpdirname is cleaned up: the merged array
+        # still reads lazily from the interpolation stores in there
+        dsm10 = dsm10.satio.cache()
 
         for t in timer10, timer20:
             t.load.log()
             t.composite.log()
             t.interpolate.log()
 
-    dsm10 = dsm10.satio.cache()
-
     return dsm10
@@ -32,9 +32,11 @@ setup(
         'h5netcdf',
         'importlib-resources',
         'loguru',
+        'numcodecs',
         'rasterio',
         'rio-cogeo',
         'shapely',
         'tqdm',
+        'zarr',
     ]
 )